@@ -137,15 +137,24 @@ class CustomDatasetDataLoader():
         self.dataset = dataset_class(opt)
         print(self.dataset)
         print("dataset [%s] was created" % type(self.dataset).__name__)
+        # with DistributedDataParallel each process loads a different part of the dataset
+        self.sampler = torch.utils.data.DistributedSampler(self.dataset, shuffle=not opt.serial_batches) if opt.distributed else None
         self.dataloader = torch.utils.data.DataLoader(
             self.dataset,
             batch_size=opt.batch_size,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.num_threads))
+            shuffle=not opt.serial_batches and self.sampler is None,
+            sampler=self.sampler,
+            num_workers=int(opt.num_threads),
+            pin_memory=len(opt.gpu_ids) > 0)  # pinned batches can be copied asynchronously to the GPU
 
     def load_data(self):
         return self
 
+    def set_epoch(self, epoch):
+        """Make the distributed sampler shuffle the data differently at every epoch"""
+        if self.sampler is not None:
+            self.sampler.set_epoch(epoch)
+
     def __len__(self):
         """Return the number of data in the dataset"""
         return min(len(self.dataset), self.opt.max_dataset_size)
@@ -212,21 +221,32 @@ class RemoteSensingCustomDatasetDataLoader():
             num_samples_t = patch_coordinates_t.shape[0]
             indexs_s = np.arange(num_samples_s)
             indexs_t = np.arange(num_samples_t)
-            np.random.shuffle(indexs_s)
-            np.random.shuffle(indexs_t)
+            # with DistributedDataParallel all the processes must build the same dataset, which the sampler then splits
+            rng = np.random.RandomState(0) if opt.distributed else np.random
+            rng.shuffle(indexs_s)
+            rng.shuffle(indexs_t)
             dataset_s.central_pixels_coordinates = patch_coordinates_s[indexs_s, :]
             dataset_t.central_pixels_coordinates = patch_coordinates_t[indexs_t, :]
             self.dataset = dataset_class(dataset_s, dataset_t, opt)  
         
+        # with DistributedDataParallel each process loads a different part of the dataset
+        self.sampler = torch.utils.data.DistributedSampler(self.dataset, shuffle=not opt.serial_batches) if opt.distributed else None
         self.dataloader = torch.utils.data.DataLoader(
             self.dataset,
             batch_size=opt.batch_size,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.num_threads))
+            shuffle=not opt.serial_batches and self.sampler is None,
+            sampler=self.sampler,
+            num_workers=int(opt.num_threads),
+            pin_memory=len(opt.gpu_ids) > 0)  # pinned batches can be copied asynchronously to the GPU
 
     def load_data(self):
         return self
 
+    def set_epoch(self, epoch):
+        """Make the distributed sampler shuffle the data differently at every epoch"""
+        if self.sampler is not None:
+            self.sampler.set_epoch(epoch)
+
     def __len__(self):
         """Return the number of data in the dataset"""
         return min(len(self.dataset), self.opt.max_dataset_size)
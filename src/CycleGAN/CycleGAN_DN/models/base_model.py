@@ -1,5 +1,6 @@
 import os
 import torch
+import contextlib
 from collections import OrderedDict
 from abc import ABC, abstractmethod
 from . import networks
@@ -33,6 +34,7 @@ class BaseModel(ABC):
         self.gpu_ids = opt.gpu_ids
         self.isTrain = opt.isTrain
         self.device = torch.device('cuda:{}'.format(self.gpu_ids[0])) if self.gpu_ids else torch.device('cpu')  # get device name: CPU or GPU
+        self.rank = torch.distributed.get_rank() if opt.distributed else 0  # process rank when training with DistributedDataParallel
         self.save_dir = os.path.join(opt.checkpoints_dir, opt.name)  # save all the checkpoints to save_dir
         if opt.preprocess != 'scale_width':  # with [scale_width], input images might have different sizes, which hurts the performance of cudnn.benchmark.
             torch.backends.cudnn.benchmark = True
@@ -122,7 +124,8 @@ class BaseModel(ABC):
                 scheduler.step()
 
         lr = self.optimizers[0].param_groups[0]['lr']
-        print('learning rate = %.7f' % lr)
+        if self.rank == 0:
+            print('learning rate = %.7f' % lr)
 
     def get_current_visuals(self):
         """Return visualization images. train.py will display these images with visdom, and save the images to a HTML"""
@@ -146,6 +149,8 @@ class BaseModel(ABC):
         Parameters:
             epoch (int) -- current epoch; used in the file name '%s_net_%s.pth' % (epoch, name)
         """
+        if self.rank != 0:  # with DistributedDataParallel all the replicas are equal, only the first process saves them
+            return
         for name in self.model_names:
             if isinstance(name, str):
                 save_filename = '%s_net_%s.pth' % (epoch, name)
@@ -153,8 +158,8 @@ class BaseModel(ABC):
                 net = getattr(self, 'net' + name)
 
                 if len(self.gpu_ids) > 0 and torch.cuda.is_available():
-                    torch.save(net.module.cpu().state_dict(), save_path)
-                    net.cuda(self.gpu_ids[0])
+                    # copied to the CPU without moving the network, so its parameters keep their storage (e.g. for a captured CUDA graph)
+                    torch.save(OrderedDict((key, value.cpu()) for key, value in net.module.state_dict().items()), save_path)
                 else:
                     torch.save(net.cpu().state_dict(), save_path)
 
@@ -183,7 +188,7 @@ class BaseModel(ABC):
                 load_filename = '%s_net_%s.pth' % (epoch, name)
                 load_path = os.path.join(self.save_dir, load_filename)
                 net = getattr(self, 'net' + name)
-                if isinstance(net, torch.nn.DataParallel):
+                if isinstance(net, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)):
                     net = net.module
                 print('loading the model from %s' % load_path)
                 # if you are using PyTorch newer than 0.4 (e.g., built from
@@ -203,6 +208,8 @@ class BaseModel(ABC):
         Parameters:
             verbose (bool) -- if verbose: print the network architecture
         """
+        if self.rank != 0:  # the networks are identical on all the processes
+            return
         print('---------- Networks initialized -------------')
         for name in self.model_names:
             if isinstance(name, str):
@@ -227,3 +234,18 @@ class BaseModel(ABC):
             if net is not None:
                 for param in net.parameters():
                     param.requires_grad = requires_grad
+
+    def no_sync(self, nets):
+        """Return a context that disables the DistributedDataParallel gradient synchronization of the networks
+        Parameters:
+            nets (network list)   -- a list of networks
+
+        It does nothing if the networks are not wrapped with DistributedDataParallel.
+        """
+        if not isinstance(nets, list):
+            nets = [nets]
+        stack = contextlib.ExitStack()
+        for net in nets:
+            if isinstance(net, torch.nn.parallel.DistributedDataParallel):
+                stack.enter_context(net.no_sync())
+        return stack
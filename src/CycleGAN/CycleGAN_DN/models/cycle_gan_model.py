@@ -1,11 +1,11 @@
 import sys
 import torch
 import itertools
+from collections import OrderedDict
 import numpy as np
-from util.image_pool import ImagePool
+from util.image_pool import BatchedImagePool, PinnedImagePool
 from .base_model import BaseModel
 from . import networks
-from torchsummary import summary
 
 
 class CycleGANModel(BaseModel):
@@ -51,6 +51,15 @@ class CycleGANModel(BaseModel):
             parser.add_argument('--lambda_identity_s', type=float, default=0, help='use identity mapping. Setting lambda_identity other than 0 has an effect of scaling the weight of the identity mapping loss. For example, if the weight of the identity loss should be 10 times smaller than the weight of the reconstruction loss, please set lambda_identity = 0.1')
             parser.add_argument('--lambda_diff_s', type=float, default=1, help='use attention mapping. Setting lmabda_attention other than 0 has an effect of scaling the weight of the attention mapping loss.')
             parser.add_argument('--lambda_diff_t', type=float, default=1, help='use attention mapping. Setting lmabda_attention other than 0 has an effect of scaling the weight of the attention mapping loss.')
+            # Performance related parameters
+            parser.add_argument('--amp', type=str, default='none', choices=['none', 'bf16', 'fp16'], help='mixed precision training [none | bf16 | fp16]. fp16 uses a GradScaler to avoid the underflow of the gradients')
+            parser.add_argument('--accum_steps', type=int, default=1, help='number of iterations whose gradients are accumulated before each update of the weights; the effective batch size is batch_size * accum_steps')
+            parser.add_argument('--pool_on_cpu', action='store_true', help='keep the buffer of generated images in pinned CPU memory instead of the GPU memory')
+            parser.add_argument('--compile_mode', type=str, default='none', choices=['none', 'default', 'reduce-overhead', 'max-autotune'], help='compile the networks with torch.compile (PyTorch >= 2.2) [none | default | reduce-overhead | max-autotune]')
+            parser.add_argument('--cuda_graph', action='store_true', help='capture the training iteration in a CUDA graph and replay it (single GPU, without --amp fp16, --accum_steps, --compile_mode and --pool_on_cpu)')
+        else:
+            parser.add_argument('--half_eval', action='store_true', help='run the generators in fp16 during test time (GPU only)')
+        parser.add_argument('--generator_streams', action='store_true', help='run the cycles A->B->A and B->A->B on two CUDA streams, so that their kernels can overlap (GPU only)')
         return parser
 
     def __init__(self, opt):
@@ -82,37 +91,71 @@ class CycleGANModel(BaseModel):
         else:  # during test time, only load Gs
             self.model_names = ['G_A', 'G_B']
 
+        # memory format of the input images, it follows the format of the networks
+        self.memory_format = torch.channels_last if opt.channels_last else torch.preserve_format
+        # the generators run in fp16 when testing with '--half_eval', so the images are given in that type
+        self.half_eval = not self.isTrain and opt.half_eval
+        self.input_dtype = torch.float16 if self.half_eval else None
+        # side stream of the asynchronous copies of the input images to the GPU
+        self.copy_stream = torch.cuda.Stream(self.device) if len(self.gpu_ids) > 0 else None
+        self.generator_streams = [torch.cuda.Stream(self.device) for _ in range(2)] if opt.generator_streams and len(self.gpu_ids) > 0 else None
         # define networks (both Generators and discriminators)
         # The naming is different from those used in the paper.
         # Code (vs. CycleGAN original paper): G_A (G), G_B (F), D_A (D_Y), D_B (D_X)
         self.netG_A = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG, opt.norm,
-                                        not opt.no_dropout, opt.linear_output, opt.init_type, opt.init_gain, self.gpu_ids)
+                                        not opt.no_dropout, opt.linear_output, opt.init_type, opt.init_gain, self.gpu_ids, opt.distributed, opt.channels_last)
         self.netG_B = networks.define_G(opt.output_nc, opt.input_nc, opt.ngf, opt.netG, opt.norm,
-                                        not opt.no_dropout, opt.linear_output, opt.init_type, opt.init_gain, self.gpu_ids)
+                                        not opt.no_dropout, opt.linear_output, opt.init_type, opt.init_gain, self.gpu_ids, opt.distributed, opt.channels_last)
+        if self.half_eval:  # the fp32 checkpoints are cast to fp16 when loaded
+            assert len(self.gpu_ids) > 0, '--half_eval requires a GPU'
+            self.netG_A.half()
+            self.netG_B.half()
         if self.isTrain:  # define discriminators
             self.netD_A = networks.define_D(opt.output_nc, opt.ndf, opt.netD,
-                                            opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
+                                            opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids, opt.distributed, opt.channels_last)
             self.netD_B = networks.define_D(opt.input_nc, opt.ndf, opt.netD,
-                                            opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
-        if self.isTrain:
-            summary(self.netG_A, (14, 256, 256))
-            summary(self.netD_A, (14, 256, 256))
+                                            opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids, opt.distributed, opt.channels_last)
+        if self.isTrain and opt.compile_mode != 'none':
+            # compiled in place, so the checkpoints keep the same state_dict keys
+            for net in [self.netG_A, self.netG_B, self.netD_A, self.netD_B]:
+                net.compile(mode=opt.compile_mode)
         
         
         if self.isTrain:
-            if opt.lambda_identity_t > 0.0:  # only works when input and output images have the same number of channels
+            if opt.lambda_identity_t > 0.0 or opt.lambda_identity_s > 0.0:  # only works when input and output images have the same number of channels
                 assert(opt.input_nc == opt.output_nc)
-            self.fake_A_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
-            self.fake_B_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
+            if opt.pool_on_cpu and len(self.gpu_ids) > 0:
+                self.fake_A_pool = PinnedImagePool(opt.pool_size, self.device)  # create image buffer in the CPU memory
+                self.fake_B_pool = PinnedImagePool(opt.pool_size, self.device)  # create image buffer in the CPU memory
+            else:
+                self.fake_A_pool = BatchedImagePool(opt.pool_size)  # create image buffer to store previously generated images
+                self.fake_B_pool = BatchedImagePool(opt.pool_size)  # create image buffer to store previously generated images
             # define loss functions
             self.criterionGAN = networks.GANLoss(opt.gan_mode).to(self.device)  # define GAN loss.
             self.criterionCycle = torch.nn.L1Loss()
             self.criterionIdt = torch.nn.L1Loss()
+            assert opt.accum_steps >= 1, '--accum_steps must be at least 1'
+            if opt.cuda_graph:  # the replayed kernels must not synchronize with the host nor change between iterations
+                assert len(self.gpu_ids) == 1 and not opt.distributed, '--cuda_graph requires a single GPU'
+                assert opt.amp != 'fp16' and opt.accum_steps == 1 and opt.compile_mode == 'none' and not opt.pool_on_cpu, \
+                    '--cuda_graph cannot be used with --amp fp16, --accum_steps, --compile_mode or --pool_on_cpu'
             # initialize optimizers; schedulers will be automatically created by function <BaseModel.setup>.
-            self.optimizer_G = torch.optim.Adam(itertools.chain(self.netG_A.parameters(), self.netG_B.parameters()), lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizer_D = torch.optim.Adam(itertools.chain(self.netD_A.parameters(), self.netD_B.parameters()), lr=opt.lr, betas=(opt.beta1, 0.999))
+            # On GPU the fused Adam updates all the parameters with a single kernel.
+            # For a CUDA graph, the optimizers are capturable and read the learning rate from a tensor, see <update_learning_rate>.
+            fused = len(self.gpu_ids) > 0
+            lr_G = torch.tensor(opt.lr, device=self.device) if opt.cuda_graph else opt.lr
+            lr_D = torch.tensor(opt.lr, device=self.device) if opt.cuda_graph else opt.lr
+            self.optimizer_G = torch.optim.Adam(itertools.chain(self.netG_A.parameters(), self.netG_B.parameters()), lr=lr_G, betas=(opt.beta1, 0.999), fused=fused, capturable=opt.cuda_graph)
+            self.optimizer_D = torch.optim.Adam(itertools.chain(self.netD_A.parameters(), self.netD_B.parameters()), lr=lr_D, betas=(opt.beta1, 0.999), fused=fused, capturable=opt.cuda_graph)
             self.optimizers.append(self.optimizer_G)
             self.optimizers.append(self.optimizer_D)
+            self.lr_tensors = [lr_G, lr_D] if opt.cuda_graph else []  # read by the captured optimizer steps
+            # mixed precision; the GradScaler does nothing unless fp16 is used
+            self.amp_dtype = torch.float16 if opt.amp == 'fp16' else torch.bfloat16
+            self.scaler = torch.amp.GradScaler('cuda', enabled=opt.amp == 'fp16')
+            self.accum_iter = 0  # number of calls to <optimize_parameters>, used for the gradient accumulation
+            self.cuda_graph = None  # captured by <capture_step>
+            self.skipped_batches = 0  # batches whose shape differs from the one of the CUDA graph
 
     def set_input(self, input):
         """Unpack input data from the dataloader and perform necessary pre-processing steps.
@@ -125,25 +168,72 @@ class CycleGANModel(BaseModel):
         # print(input)
         if self.opt.dataset_type == 'common_images':
             AtoB = self.opt.direction == 'AtoB'
-            self.real_A = input['A' if AtoB else 'B'].to(self.device)
-            self.real_B = input['B' if AtoB else 'A'].to(self.device)
+            self.real_A = self.to_device(input['A' if AtoB else 'B'])
+            self.real_B = self.to_device(input['B' if AtoB else 'A'])
             self.image_paths = input['A_paths' if AtoB else 'B_paths']
         if self.opt.dataset_type == 'remote_sensing_images':
             AtoB = self.opt.direction == 'AtoB'
-            self.real_A = input['A' if AtoB else 'B'].to(self.device)
-            self.real_B = input['B' if AtoB else 'A'].to(self.device)
+            self.real_A = self.to_device(input['A' if AtoB else 'B'])
+            self.real_B = self.to_device(input['B' if AtoB else 'A'])
            
             if self.opt.phase == 'train':
                 # Real difference images of each domain
-                self.real_diff_A = input['A_ref' if AtoB else 'B_ref'].to(self.device)
-                self.real_diff_B = input['B_ref' if AtoB else 'A_ref'].to(self.device)
+                self.real_diff_A = self.to_device(input['A_ref' if AtoB else 'B_ref'])
+                self.real_diff_B = self.to_device(input['B_ref' if AtoB else 'A_ref'])
+
+    def to_device(self, data):
+        """Copy a tensor of the data loader to the device, in the memory format (and type) of the networks
+
+        On GPU the copy does not block the host and runs on a side stream, so it overlaps with the computations
+        already queued; <forward> waits for it before using the images. The data loader batches are pinned
+        (see <data.create_dataset>), which makes the copies asynchronous.
+        """
+        if self.copy_stream is None:
+            return data.to(self.device, dtype=self.input_dtype, memory_format=self.memory_format)
+        with torch.cuda.stream(self.copy_stream):
+            data = data.to(self.device, dtype=self.input_dtype, non_blocking=True, memory_format=self.memory_format)
+        data.record_stream(torch.cuda.current_stream(self.device))  # allocated on the copy stream but used on the current one
+        return data
 
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
-        self.fake_B, self.diff_A = self.netG_A(self.real_A)  # G_A(A)
-        self.rec_A, _ = self.netG_B(self.fake_B)   # G_B(G_A(A))
-        self.fake_A, self.diff_B = self.netG_B(self.real_B)  # G_B(B)
-        self.rec_B, _ = self.netG_A(self.fake_A)   # G_A(G_B(B))
+        if self.copy_stream is not None and not torch.cuda.is_current_stream_capturing():  # wait for the images copied by <set_input>
+            torch.cuda.current_stream(self.device).wait_stream(self.copy_stream)
+        if self.generator_streams is None:
+            self.forward_A()
+            self.forward_B()
+        else:  # the two cycles are independent, a single one does not always fill the GPU (e.g. with small batches)
+            current_stream = torch.cuda.current_stream(self.device)
+            for stream, forward_cycle in zip(self.generator_streams, [self.forward_A, self.forward_B]):
+                stream.wait_stream(current_stream)  # fork once the inputs are ready
+                with torch.cuda.stream(stream):
+                    forward_cycle()
+            for stream in self.generator_streams:
+                current_stream.wait_stream(stream)  # join before the losses
+            for image in [self.fake_B, self.rec_A, self.fake_A, self.rec_B]:
+                image.record_stream(current_stream)  # allocated on a side stream, but also used on the current one
+        if self.isTrain:  # differences of the translated dates, used by the difference loss
+            self.diff_A = networks.temporal_difference(self.fake_B)  # G_A(A_2) - G_A(A_1)
+            self.diff_B = networks.temporal_difference(self.fake_A)  # G_B(B_2) - G_B(B_1)
+
+    def forward_A(self):
+        """Translate the images of domain A and back; called by <forward>."""
+        self.fake_B = self.netG_A(self.real_A)  # G_A(A)
+        self.rec_A = self.netG_B(self.fake_B)   # G_B(G_A(A))
+
+    def forward_B(self):
+        """Translate the images of domain B and back; called by <forward>."""
+        self.fake_A = self.netG_B(self.real_B)  # G_B(B)
+        self.rec_B = self.netG_A(self.fake_A)   # G_A(G_B(B))
+
+    def forward_identity(self):
+        """Run the identity mappings of the target identity losses, G_A(B) and G_B(A)
+
+        The ones of the source identity losses, G_A(A) and G_B(B), are the translations fake_B and fake_A of <forward>.
+        """
+        idt_A = self.netG_A(self.real_B)
+        idt_B = self.netG_B(self.real_A)
+        return idt_A, idt_B
 
     def backward_D_basic(self, netD, real, fake):
         """Calculate GAN loss for the discriminator
@@ -155,16 +245,21 @@ class CycleGANModel(BaseModel):
 
         Return the discriminator loss.
         We also call loss_D.backward() to calculate the gradients.
+        Real and fake images go through netD in a single batch, unless batch normalization
+        is used, since it would mix the statistics of both sets.
         """
+        if self.opt.norm != 'batch':
+            pred_real, pred_fake = netD(torch.cat((real, fake.detach()), 0)).split([real.size(0), fake.size(0)], 0)
+        else:
+            pred_real = netD(real)
+            pred_fake = netD(fake.detach())
         # Real
-        pred_real = netD(real)
         loss_D_real = self.criterionGAN(pred_real, True)
         # Fake
-        pred_fake = netD(fake.detach())
         loss_D_fake = self.criterionGAN(pred_fake, False)
         # Combined loss and calculate gradients
         loss_D = (loss_D_real + loss_D_fake) * 0.5
-        loss_D.backward()
+        self.scaler.scale(loss_D / self.opt.accum_steps).backward()  # averaged over the accumulated iterations
         return loss_D
 
     def backward_D_A(self):
@@ -186,68 +281,145 @@ class CycleGANModel(BaseModel):
         lambda_diff_s = self.opt.lambda_diff_s
         lambda_diff_t = self.opt.lambda_diff_t
         
-        # Identity loss
-        if lambda_idt_t > 0 or lambda_idt_s > 0:
+        # Identity loss; each term is only computed if its weight is positive
+        self.loss_idt_A = torch.zeros((), device=self.device)
+        self.loss_idt_B = torch.zeros((), device=self.device)
+        if lambda_idt_t > 0:
+            self.idt_A, self.idt_B = self.forward_identity()
             # G_A should be identity if real_B is fed: ||G_A(B) - B||
-            self.idt_A, _= self.netG_A(self.real_B)
-            self.loss_idt_A_t = self.criterionIdt(self.idt_A, self.real_B) * lambda_B * lambda_idt_t
+            self.loss_idt_A = self.criterionIdt(self.idt_A, self.real_B) * lambda_B * lambda_idt_t
             # G_B should be identity if real_A is fed: ||G_B(A) - A||
-            self.idt_B, _ = self.netG_B(self.real_A)
-            self.loss_idt_B_t = self.criterionIdt(self.idt_B, self.real_A) * lambda_A * lambda_idt_t
+            self.loss_idt_B = self.criterionIdt(self.idt_B, self.real_A) * lambda_A * lambda_idt_t
+        if lambda_idt_s > 0:
             #Additionaly we try to keep the unchanging structures of domains into their respective targets
             # G_A also should be identity if real_A is fed: ||G_A(A) - A||
-            self.idt_A_s, _ = self.netG_A(self.real_A)
-            self.loss_idt_A_s = self.criterionIdt(self.idt_A_s, self.real_A) * lambda_A * lambda_idt_s
+            self.loss_idt_A = self.loss_idt_A + self.criterionIdt(self.fake_B, self.real_A) * lambda_A * lambda_idt_s
             # G_B also should be identity if real_B is fed: ||G_B(B) - B||
-            self.idt_B_s, _ = self.netG_B(self.real_B)
-            self.loss_idt_B_s = self.criterionIdt(self.idt_B_s, self.real_B) * lambda_B * lambda_idt_s
-            
-            self.loss_idt_A = self.loss_idt_A_t + self.loss_idt_A_s
-            self.loss_idt_B = self.loss_idt_B_t + self.loss_idt_B_s
-            
-        else:
-            
-            self.loss_idt_A = 0
-            self.loss_idt_B = 0
-            
-        # Computing the normalizations of the differences terms
-        self.real_diff_A_ = (torch.norm(self.real_diff_A, dim = 1)).mean(dim=(1,2))   #Norm2(A_2 - A_1)
-        self.real_diff_B_ = (torch.norm(self.real_diff_B, dim = 1)).mean(dim=(1,2))   #Norm2(B_2 - B_1)
-        self.diff_A_ = (torch.norm(self.diff_A, dim = 1)).mean(dim=(1,2))     #Norm2(G_A(A_2) - G_A(A_1))
-        self.diff_B_ = (torch.norm(self.diff_B, dim = 1)).mean(dim=(1,2))     #Norm2(G_B(B_2) - G_B(B_1))
-        
-        # Normalizing the differences of real and generated images
-        self.real_diff_A_norm = self.real_diff_A/self.real_diff_A_  # (A_2 - A_1)/Norm2(A_2 - A_1)
-        self.real_diff_B_norm = self.real_diff_B/self.real_diff_B_  # (B_2 - B_1)/Norm2(B_2 - B_1)
-        self.diff_A_norm = self.diff_A/self.diff_A_     # (G_A(A_2) - G_A(A_1))/Norm2(G_A(A_2) - G_A(A_1))
-        self.diff_B_norm = self.diff_B/self.diff_B_     # (G_B(B_2) - G_B(B_1))/Norm2(G_B(B_2) - G_B(B_1))
-        # GAN loss D_A(G_A(A))
-        self.loss_G_A = self.criterionGAN(self.netD_A(self.fake_B), True)
-        # GAN loss D_B(G_B(B))
-        self.loss_G_B = self.criterionGAN(self.netD_B(self.fake_A), True)
+            self.loss_idt_B = self.loss_idt_B + self.criterionIdt(self.fake_A, self.real_B) * lambda_B * lambda_idt_s
+
+        # The normalizations divide by small norms, so they are kept in fp32 even under mixed precision
+        with torch.autocast(device_type=self.device.type, enabled=False):
+            # Computing the normalizations of the differences terms
+            real_diff_A_ = networks.average_channel_norm(self.real_diff_A.float())   #Norm2(A_2 - A_1)
+            real_diff_B_ = networks.average_channel_norm(self.real_diff_B.float())   #Norm2(B_2 - B_1)
+            diff_A_ = networks.average_channel_norm(self.diff_A.float())     #Norm2(G_A(A_2) - G_A(A_1))
+            diff_B_ = networks.average_channel_norm(self.diff_B.float())     #Norm2(G_B(B_2) - G_B(B_1))
+
+            # Normalizing the differences of real and generated images
+            real_diff_A_norm = self.real_diff_A.float()/real_diff_A_  # (A_2 - A_1)/Norm2(A_2 - A_1)
+            real_diff_B_norm = self.real_diff_B.float()/real_diff_B_  # (B_2 - B_1)/Norm2(B_2 - B_1)
+            diff_A_norm = self.diff_A.float()/diff_A_     # (G_A(A_2) - G_A(A_1))/Norm2(G_A(A_2) - G_A(A_1))
+            diff_B_norm = self.diff_B.float()/diff_B_     # (G_B(B_2) - G_B(B_1))/Norm2(G_B(B_2) - G_B(B_1))
+        # Ds are frozen here, so with DDP their forward must not wait for a gradient synchronization
+        with self.no_sync([self.netD_A, self.netD_B]):
+            # GAN loss D_A(G_A(A))
+            self.loss_G_A = self.criterionGAN(self.netD_A(self.fake_B), True)
+            # GAN loss D_B(G_B(B))
+            self.loss_G_B = self.criterionGAN(self.netD_B(self.fake_A), True)
         # Forward cycle loss || G_B(G_A(A)) - A||
         self.loss_cycle_A = self.criterionCycle(self.rec_A, self.real_A) * lambda_A
         # Backward cycle loss || G_A(G_B(B)) - B||
         self.loss_cycle_B = self.criterionCycle(self.rec_B, self.real_B) * lambda_B
         # Computing the normalized difference loss
-        self.loss_diff_A = (torch.norm(self.diff_A_norm - self.real_diff_A_norm, dim=1)).mean() * lambda_A * lambda_diff_s
-        self.loss_diff_B = (torch.norm(self.diff_B_norm - self.real_diff_B_norm, dim=1)).mean() * lambda_B * lambda_diff_t
+        self.loss_diff_A = torch.linalg.vector_norm(diff_A_norm - real_diff_A_norm, dim=1).mean() * lambda_A * lambda_diff_s
+        self.loss_diff_B = torch.linalg.vector_norm(diff_B_norm - real_diff_B_norm, dim=1).mean() * lambda_B * lambda_diff_t
         # combined loss and calculate gradients
         self.loss_G = self.loss_G_A + self.loss_G_B + self.loss_cycle_A + self.loss_cycle_B + self.loss_idt_A + self.loss_idt_B + self.loss_diff_A + self.loss_diff_B
-        self.loss_G.backward()
+        self.scaler.scale(self.loss_G / self.opt.accum_steps).backward()  # averaged over the accumulated iterations
+
+    def autocast(self):
+        """Return the autocast context of the training passes; it is disabled with '--amp none'"""
+        # the autocast cache cannot be used while capturing a CUDA graph
+        return torch.autocast(device_type=self.device.type, dtype=self.amp_dtype, enabled=self.opt.amp != 'none', cache_enabled=not self.opt.cuda_graph)
+
+    def update_learning_rate(self):
+        """Update learning rates for all the networks; called at the end of every epoch
+
+        With '--cuda_graph' the new rates are copied into the learning rate tensors read by the CUDA graph.
+        """
+        BaseModel.update_learning_rate(self)
+        for optimizer, lr in zip(self.optimizers, self.lr_tensors):
+            # depending on the PyTorch version, the schedulers update the tensor in place or replace it
+            lr.fill_(float(optimizer.param_groups[0]['lr']))
+            optimizer.param_groups[0]['lr'] = lr
 
     def optimize_parameters(self):
-        """Calculate losses, gradients, and update network weights; called in every training iteration"""
-        # forward
-        self.forward()      # compute fake images and reconstruction images.
-        # G_A and G_B
-        self.set_requires_grad([self.netD_A, self.netD_B], False)  # Ds require no gradients when optimizing Gs
-        self.optimizer_G.zero_grad()  # set G_A and G_B's gradients to zero
-        self.backward_G()             # calculate gradients for G_A and G_B
-        self.optimizer_G.step()       # update G_A and G_B's weights
+        """Calculate losses, gradients, and update network weights; called in every training iteration
+
+        With '--accum_steps N' the gradients of N iterations are accumulated before updating the weights.
+        With '--cuda_graph' an iteration is captured in a CUDA graph once the image pools are full, and replayed afterwards.
+        """
+        if self.cuda_graph is not None:
+            self.replay_step()
+            return
+        self.accum_iter += 1
+        update = self.accum_iter % self.opt.accum_steps == 0
+        # the capture waits for a few warm-up iterations (e.g. for cudnn.benchmark) and for the image pools to be full,
+        # so that the Python branches of their queries no longer change; an incomplete batch must not set the static shapes
+        pools_full = all(pool.pool_size == 0 or pool.num_imgs == pool.pool_size for pool in [self.fake_A_pool, self.fake_B_pool])
+        full_batch = self.real_A.size(0) == self.opt.batch_size
+        if self.opt.cuda_graph and self.accum_iter > 3 and pools_full and full_batch:
+            self.capture_step()
+        else:
+            self.train_step(update)
+
+    def train_step(self, update):
+        """Run the forward and backward passes of an iteration
+
+        Parameters:
+            update (bool) -- if the weights are updated with the accumulated gradients
+        """
+        # with DDP, the gradients are only synchronized in the iterations that update the weights
+        with self.no_sync([] if update else [self.netG_A, self.netG_B]):
+            # forward
+            with self.autocast():
+                self.forward()      # compute fake images and reconstruction images.
+            # G_A and G_B
+            self.set_requires_grad([self.netD_A, self.netD_B], False)  # Ds require no gradients when optimizing Gs
+            with self.autocast():
+                self.backward_G()             # calculate gradients for G_A and G_B
+        if update:
+            self.scaler.step(self.optimizer_G)       # update G_A and G_B's weights
+            self.optimizer_G.zero_grad(set_to_none=True)  # reset G_A and G_B's gradients
         # D_A and D_B
         self.set_requires_grad([self.netD_A, self.netD_B], True)
-        self.optimizer_D.zero_grad()   # set D_A and D_B's gradients to zero
-        self.backward_D_A()      # calculate gradients for D_A
-        self.backward_D_B()      # calculate graidents for D_B
-        self.optimizer_D.step()  # update D_A and D_B's weights
+        with self.no_sync([] if update else [self.netD_A, self.netD_B]):
+            with self.autocast():
+                self.backward_D_A()      # calculate gradients for D_A
+                self.backward_D_B()      # calculate graidents for D_B
+        if update:
+            self.scaler.step(self.optimizer_D)  # update D_A and D_B's weights
+            self.optimizer_D.zero_grad(set_to_none=True)   # reset D_A and D_B's gradients
+            self.scaler.update()     # one scale update per weights update, shared by both optimizers
+
+    def capture_step(self):
+        """Train on the current images and capture the training iteration in a CUDA graph
+
+        The current input images become the static inputs of the graph, and the images and losses
+        computed during the capture are its static outputs, updated by every replay.
+        """
+        self.static_inputs = OrderedDict((name, getattr(self, name)) for name in ['real_A', 'real_B', 'real_diff_A', 'real_diff_B'] if hasattr(self, name))
+        # the iteration of the current images runs on a side stream, which warms up the capture
+        current_stream = torch.cuda.current_stream(self.device)
+        warmup_stream = torch.cuda.Stream(self.device)
+        warmup_stream.wait_stream(current_stream)
+        with torch.cuda.stream(warmup_stream):
+            self.train_step(True)
+        current_stream.wait_stream(warmup_stream)
+        self.cuda_graph = torch.cuda.CUDAGraph()
+        # thread local, since the pin memory thread of the DataLoader keeps calling CUDA during the capture
+        with torch.cuda.graph(self.cuda_graph, capture_error_mode='thread_local'):
+            self.train_step(True)
+
+    def replay_step(self):
+        """Run a training iteration by replaying the CUDA graph on the current input images"""
+        if any(getattr(self, name).shape != static_input.shape for name, static_input in self.static_inputs.items()):
+            # the graph has static shapes, so the incomplete last batch of an epoch is skipped
+            self.skipped_batches += 1
+            print('Skipping a batch of %d images, the CUDA graph was captured for %d (%d batches skipped so far)'
+                  % (self.real_A.size(0), self.static_inputs['real_A'].size(0), self.skipped_batches))
+            return
+        torch.cuda.current_stream(self.device).wait_stream(self.copy_stream)
+        for name, static_input in self.static_inputs.items():
+            static_input.copy_(getattr(self, name))
+        self.cuda_graph.replay()
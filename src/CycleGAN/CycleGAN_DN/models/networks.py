@@ -35,6 +35,29 @@ def get_norm_layer(norm_type='instance'):
     return norm_layer
 
 
+def temporal_difference(images):
+    """Return the difference between the two dates of a bi-temporal image, (T2 - T1)
+
+    Parameters:
+        images (tensor) -- images with the channels of time 1 followed by the ones of time 2
+
+    It is used by the difference loss of CycleGAN, e.g. G_A(A_2) - G_A(A_1).
+    """
+    half = images.size(1) // 2
+    return images[:, half:, :, :] - images[:, :half, :, :]
+
+
+def average_channel_norm(images):
+    """Return the spatial mean of the L2 norms along the channels, one value per sample shaped as (N, 1, 1, 1)
+
+    Parameters:
+        images (tensor) -- images of shape (N, C, H, W)
+
+    The shape allows to normalize the images by broadcasting, e.g. images / average_channel_norm(images).
+    """
+    return torch.linalg.vector_norm(images, dim=1).mean(dim=(1, 2)).view(-1, 1, 1, 1)
+
+
 def get_scheduler(optimizer, opt):
     """Return a learning rate scheduler
 
@@ -98,25 +121,32 @@ def init_weights(net, init_type='normal', init_gain=0.02):
     net.apply(init_func)  # apply the initialization function <init_func>
 
 
-def init_net(net, init_type='normal', init_gain=0.02, gpu_ids=[]):
+def init_net(net, init_type='normal', init_gain=0.02, gpu_ids=[], distributed=False, channels_last=False):
     """Initialize a network: 1. register CPU/GPU device (with multi-GPU support); 2. initialize the network weights
     Parameters:
         net (network)      -- the network to be initialized
         init_type (str)    -- the name of an initialization method: normal | xavier | kaiming | orthogonal
         gain (float)       -- scaling factor for normal, xavier and orthogonal.
         gpu_ids (int list) -- which GPUs the network runs on: e.g., 0,1,2
+        distributed (bool) -- wrap the network with DistributedDataParallel (one process per GPU) instead of DataParallel
+        channels_last (bool) -- store the weights in the channels_last (NHWC) memory format
 
     Return an initialized network.
     """
+    if channels_last:
+        net.to(memory_format=torch.channels_last)
     if len(gpu_ids) > 0:
         assert(torch.cuda.is_available())
         net.to(gpu_ids[0])
-        net = torch.nn.DataParallel(net, gpu_ids)  # multi-GPUs
+        if not distributed:
+            net = torch.nn.DataParallel(net, gpu_ids)  # multi-GPUs
     init_weights(net, init_type, init_gain=init_gain)
+    if distributed:  # DDP broadcasts the initial weights of rank 0 to the other processes
+        net = torch.nn.parallel.DistributedDataParallel(net, device_ids=[gpu_ids[0]])
     return net
 
 
-def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, linear_output=False,  init_type='normal', init_gain=0.02, gpu_ids=[]):
+def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, linear_output=False,  init_type='normal', init_gain=0.02, gpu_ids=[], distributed=False, channels_last=False):
     """Create a generator
 
     Parameters:
@@ -129,6 +159,8 @@ def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, li
         init_type (str)    -- the name of our initialization method.
         init_gain (float)  -- scaling factor for normal, xavier and orthogonal.
         gpu_ids (int list) -- which GPUs the network runs on: e.g., 0,1,2
+        distributed (bool) -- if use DistributedDataParallel instead of DataParallel.
+        channels_last (bool) -- if use the channels_last memory format.
 
     Returns a generator
 
@@ -156,10 +188,10 @@ def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, li
         net = UnetGenerator(input_nc, output_nc, 8, ngf, norm_layer=norm_layer, use_dropout=use_dropout, linear_output=linear_output)
     else:
         raise NotImplementedError('Generator model name [%s] is not recognized' % netG)
-    return init_net(net, init_type, init_gain, gpu_ids)
+    return init_net(net, init_type, init_gain, gpu_ids, distributed, channels_last)
 
 
-def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal', init_gain=0.02, gpu_ids=[]):
+def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal', init_gain=0.02, gpu_ids=[], distributed=False, channels_last=False):
     """Create a discriminator
 
     Parameters:
@@ -171,6 +203,8 @@ def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal'
         init_type (str)    -- the name of the initialization method.
         init_gain (float)  -- scaling factor for normal, xavier and orthogonal.
         gpu_ids (int list) -- which GPUs the network runs on: e.g., 0,1,2
+        distributed (bool) -- if use DistributedDataParallel instead of DataParallel.
+        channels_last (bool) -- if use the channels_last memory format.
 
     Returns a discriminator
 
@@ -200,7 +234,7 @@ def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal'
         net = PixelDiscriminator(input_nc, ndf, norm_layer=norm_layer)
     else:
         raise NotImplementedError('Discriminator model name [%s] is not recognized' % netD)
-    return init_net(net, init_type, init_gain, gpu_ids)
+    return init_net(net, init_type, init_gain, gpu_ids, distributed, channels_last)
 
 
 ##############################################################################
@@ -371,11 +405,8 @@ class ResnetGenerator(nn.Module):
 
     def forward(self, input):
         """Standard forward"""
-        "Adding a second output that will try to produce an a difference image we should be equal with the difference of the real image used as input"
-        output1 = self.model(input)
-        #Computing the difference of the translated domain
-        output2 = output1[:, -7: , :, :] - output1[:, :-7, :, :]
-        return output1, output2
+        # The difference of the translated dates is computed by <temporal_difference> only where the difference loss needs it
+        return self.model(input)
 
 
 class ResnetBlock(nn.Module):
@@ -2,7 +2,6 @@ import sys
 import torch
 from .base_model import BaseModel
 from . import networks
-from torchsummary import summary
 
 
 class Pix2PixModel(BaseModel):
@@ -65,9 +64,6 @@ class Pix2PixModel(BaseModel):
             self.netD = networks.define_D(opt.input_nc + opt.output_nc, opt.ndf, opt.netD,
                                           opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
 
-        summary(self.netG, (14, 256, 256))
-        summary(self.netD, (28, 256, 256))
-        
         if self.isTrain:
             # define loss functions
             self.criterionGAN = networks.GANLoss(opt.gan_mode).to(self.device)
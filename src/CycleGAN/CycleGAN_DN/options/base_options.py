@@ -23,6 +23,7 @@ class BaseOptions():
         parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, valA, valB, etc)')
         parser.add_argument('--name', type=str, default='experiment_name', help='name of the experiment. It decides where to store samples and models')
         parser.add_argument('--gpu_ids', type=str, default='0', help='gpu ids: e.g. 0  0,1,2, 0,2. use -1 for CPU')
+        parser.set_defaults(distributed=False)  # '--distributed' is only a training option
         parser.add_argument('--checkpoints_dir', type=str, default='./checkpoints', help='models are saved here')
         # model parameters
         parser.add_argument('--model', type=str, default='cycle_gan', help='chooses which model to use. [cycle_gan | pix2pix | test | colorization]')
@@ -37,6 +38,7 @@ class BaseOptions():
         parser.add_argument('--init_type', type=str, default='normal', help='network initialization [normal | xavier | kaiming | orthogonal]')
         parser.add_argument('--init_gain', type=float, default=0.02, help='scaling factor for normal, xavier and orthogonal.')
         parser.add_argument('--no_dropout', action='store_true', help='no dropout for the generator')
+        parser.add_argument('--channels_last', action='store_true', help='use the channels_last (NHWC) memory format for the networks and images, faster with cuDNN tensor cores')
         # dataset parameters
         parser.add_argument('--dataset_type', type=str, default='remote_sensing_images', help='chooses the type of dataset, [common_images | remote_sensing_images]')
         parser.add_argument('--dataset_mode', type=str, default='remote_sensing_unaligned', help='chooses how datasets are loaded. [unaligned | aligned | single | colorization]')
@@ -130,6 +132,8 @@ class BaseOptions():
             id = int(str_id)
             if id >= 0:
                 opt.gpu_ids.append(id)
+        if opt.distributed:  # one process per GPU; the launcher sets LOCAL_RANK for each of them
+            opt.gpu_ids = [int(os.environ.get('LOCAL_RANK', 0))]
         if len(opt.gpu_ids) > 0:
             torch.cuda.set_device(opt.gpu_ids[0])
 
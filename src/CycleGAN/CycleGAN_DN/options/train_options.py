@@ -35,6 +35,7 @@ class TrainOptions(BaseOptions):
         parser.add_argument('--pool_size', type=int, default=50, help='the size of image buffer that stores previously generated images')
         parser.add_argument('--lr_policy', type=str, default='linear', help='learning rate policy. [linear | step | plateau | cosine]')
         parser.add_argument('--lr_decay_iters', type=int, default=50, help='multiply by a gamma every lr_decay_iters iterations')
+        parser.add_argument('--distributed', action='store_true', help='use DistributedDataParallel with one process per GPU (e.g. launched by torchrun). The GPU of each process is given by LOCAL_RANK and overrides --gpu_ids')
 
         self.isTrain = True
         return parser
@@ -28,6 +28,7 @@ See frequently asked questions at: https://github.com/junyanz/pytorch-CycleGAN-a
 """
 import time
 import sys
+import torch
 from options.train_options import TrainOptions
 from options.remote_sensing_train_options import RemoteSensingTrainOptions
 from data import create_dataset
@@ -36,13 +37,19 @@ from util.remote_sensing_visualizer import RemoteSensingVisualizer
 
 if __name__ == '__main__':
     opt = RemoteSensingTrainOptions().parse()   # get training option
+    if opt.distributed:
+        torch.distributed.init_process_group('nccl')   # one process per GPU, see '--distributed'
+    # with '--distributed', only the first process displays, logs and saves the results
+    is_main_process = not opt.distributed or torch.distributed.get_rank() == 0
     dataset, scalers = create_dataset(opt)  # create a dataset given opt.dataset_mode and other options
     dataset_size = len(dataset)    # get the number of images in the dataset.
-    print('The number of training images = %d' % dataset_size)
+    if is_main_process:
+        print('The number of training images = %d' % dataset_size)
     
     model = create_model(opt)      # create a model given opt.model and other options
     model.setup(opt)               # regular setup: load and print networks; create schedulers
-    visualizer = RemoteSensingVisualizer(scalers, opt)   # create a visualizer that display/save images and plots
+    if is_main_process:
+        visualizer = RemoteSensingVisualizer(scalers, opt)   # create a visualizer that display/save images and plots
     total_iters = 0                # the total number of training iterations
     
 
@@ -50,37 +57,40 @@ if __name__ == '__main__':
         epoch_start_time = time.time()  # timer for entire epoch
         iter_data_time = time.time()    # timer for data loading per iteration
         epoch_iter = 0                  # the number of training iterations in current epoch, reset to 0 every epoch
+        dataset.set_epoch(epoch)        # reshuffle the distributed sampler (if any) at every epoch
 
         for i, data in enumerate(dataset):  # inner loop within one epoch
             iter_start_time = time.time()  # timer for computation per iteration
             if total_iters % opt.print_freq == 0:
                 t_data = iter_start_time - iter_data_time
-            visualizer.reset()
+            if is_main_process:
+                visualizer.reset()
             total_iters += opt.batch_size
             epoch_iter += opt.batch_size
             model.set_input(data)         # unpack data from dataset and apply preprocessing
             model.optimize_parameters()   # calculate loss functions, get gradients, update network weights
-            if total_iters % opt.display_freq == 0:   # display images on visdom and save images to a HTML file
+            if is_main_process and total_iters % opt.display_freq == 0:   # display images on visdom and save images to a HTML file
                 save_result = total_iters % opt.update_html_freq == 0
                 visualizer.display_current_results(model.get_current_visuals(), epoch, save_result)
                 print('Images saved with success!')
-            if total_iters % opt.print_freq == 0:    # print training losses and save logging information to the disk
+            if is_main_process and total_iters % opt.print_freq == 0:    # print training losses and save logging information to the disk
                 losses = model.get_current_losses()
                 t_comp = (time.time() - iter_start_time) / opt.batch_size
                 visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data)
                 if opt.display_id > 0:
                     visualizer.plot_current_losses(epoch, float(epoch_iter) / dataset_size, losses)
 
-            if total_iters % opt.save_latest_freq == 0:   # cache our latest model every <save_latest_freq> iterations
+            if is_main_process and total_iters % opt.save_latest_freq == 0:   # cache our latest model every <save_latest_freq> iterations
                 print('saving the latest model (epoch %d, total_iters %d)' % (epoch, total_iters))
                 save_suffix = 'iter_%d' % total_iters if opt.save_by_iter else 'latest'
                 model.save_networks(save_suffix)
 
             iter_data_time = time.time()
-        if epoch % opt.save_epoch_freq == 0:              # cache our model every <save_epoch_freq> epochs
+        if is_main_process and epoch % opt.save_epoch_freq == 0:              # cache our model every <save_epoch_freq> epochs
             print('saving the model at the end of epoch %d, iters %d' % (epoch, total_iters))
             model.save_networks('latest')
             model.save_networks(epoch)
 
-        print('End of epoch %d / %d \t Time Taken: %d sec' % (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time))
+        if is_main_process:
+            print('End of epoch %d / %d \t Time Taken: %d sec' % (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time))
         model.update_learning_rate()                     # update learning rates at the end of every epoch.
@@ -52,3 +52,112 @@ class ImagePool():
                     return_images.append(image)
         return_images = torch.cat(return_images, 0)   # collect all the images and return
         return return_images
+
+
+class BatchedImagePool(ImagePool):
+    """This class implements an image buffer that stores previously generated images in a single tensor.
+
+    It follows the same 50/100 policy as <ImagePool>, but a whole batch is processed with
+    tensor operations on the device of the images instead of a Python loop over the samples.
+    """
+
+    def __init__(self, pool_size):
+        """Initialize the BatchedImagePool class
+
+        Parameters:
+            pool_size (int) -- the size of image buffer, if pool_size=0, no buffer will be created
+        """
+        ImagePool.__init__(self, pool_size)
+        self.storage = None  # allocated with the shape of the first queried images
+
+    def query(self, images):
+        """Return an image from the pool.
+
+        Parameters:
+            images: the latest generated images from the generator
+
+        Returns images from the buffer.
+        """
+        if self.pool_size == 0:  # if the buffer size is 0, do nothing
+            return images
+        images = images.detach()
+        if self.storage is None:
+            self.storage = images.new_empty((self.pool_size,) + images.shape[1:])
+        num_images = images.size(0)
+        if self.num_imgs < self.pool_size:   # if the buffer is not full; keep inserting current images to the buffer
+            num_inserted = min(num_images, self.pool_size - self.num_imgs)
+            self.storage[self.num_imgs:self.num_imgs + num_inserted] = images[:num_inserted]
+            self.num_imgs = self.num_imgs + num_inserted
+            if num_inserted == num_images:
+                return images
+            return torch.cat((images[:num_inserted], self.query(images[num_inserted:])), 0)
+        if num_images > self.pool_size:  # each image of a query needs its own slot
+            return torch.cat((self.query(images[:self.pool_size]), self.query(images[self.pool_size:])), 0)
+        # by 50% chance, each image is swapped with a random stored image, otherwise the current image is returned
+        swap = (torch.rand(num_images, device=images.device) < 0.5).view(-1, 1, 1, 1)
+        # distinct slots, so that an image written back unchanged cannot overwrite a swapped one
+        random_ids = torch.randperm(self.pool_size, device=images.device)[:num_images]
+        stored_images = self.storage.index_select(0, random_ids)
+        return_images = torch.where(swap, stored_images, images)
+        # the swapped slots receive the current images, the other selected slots are written back unchanged
+        self.storage.index_copy_(0, random_ids, torch.where(swap, images, stored_images))
+        return return_images
+
+
+class PinnedImagePool(ImagePool):
+    """This class implements an image buffer that keeps the previously generated images in pinned CPU memory.
+
+    It behaves as <ImagePool>, but the buffer does not take GPU memory.
+    The images are moved with asynchronous copies, the ones going back to the GPU are issued on a side CUDA stream.
+    """
+
+    def __init__(self, pool_size, device):
+        """Initialize the PinnedImagePool class
+
+        Parameters:
+            pool_size (int) -- the size of image buffer, if pool_size=0, no buffer will be created
+            device          -- the CUDA device of the generated images
+        """
+        ImagePool.__init__(self, pool_size)
+        self.device = device
+        self.copy_stream = torch.cuda.Stream(device)
+
+    def to_host(self, image):
+        """Copy an image to a new pinned CPU tensor without blocking the host"""
+        host_image = torch.empty(image.shape, dtype=image.dtype, pin_memory=True)
+        host_image.copy_(image, non_blocking=True)
+        return host_image
+
+    def query(self, images):
+        """Return an image from the pool.
+
+        Parameters:
+            images: the latest generated images from the generator
+
+        Returns images from the buffer, on the device of the generated images.
+        """
+        if self.pool_size == 0:  # if the buffer size is 0, do nothing
+            return images
+        current_stream = torch.cuda.current_stream(self.device)
+        return_images = []
+        for image in images:
+            image = torch.unsqueeze(image.data, 0)
+            if self.num_imgs < self.pool_size:   # if the buffer is not full; keep inserting current images to the buffer
+                self.num_imgs = self.num_imgs + 1
+                self.images.append(self.to_host(image))
+                return_images.append(image)
+            else:
+                p = random.uniform(0, 1)
+                if p > 0.5:  # by 50% chance, the buffer will return a previously stored image, and insert the current image into the buffer
+                    random_id = random.randint(0, self.pool_size - 1)  # randint is inclusive
+                    self.copy_stream.wait_stream(current_stream)  # the stored image may still be in its way to the CPU
+                    with torch.cuda.stream(self.copy_stream):
+                        tmp = self.images[random_id].to(self.device, non_blocking=True)
+                    tmp.record_stream(current_stream)  # it was allocated on the copy stream but is used on the current one
+                    self.images[random_id] = self.to_host(image)
+                    return_images.append(tmp)
+                else:       # by another 50% chance, the buffer will return the current image
+                    return_images.append(image)
+        current_stream.wait_stream(self.copy_stream)
+        return_images = torch.cat(return_images, 0)   # collect all the images and return
+        return return_images